@@ -0,0 +1,134 @@
+# concurrency.py
+import os
+import asyncio
+import multiprocessing
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Tuple, Any
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# --- Configuration ---
+# Each kind of heavy work gets its own bounded pool so one slow class of
+# request can never starve another (or FastAPI's shared threadpool).
+# Every limiter below maps onto its own executor(s):
+#   search -> search_pool   (/search and /ask retrieval)
+#   graph  -> graph_pool + layout_pool
+#   io     -> io_pool       (/kb/create, /stage/scan)
+def _env_int(key: str, default: int) -> int:
+    return int(os.environ.get(key, default))
+
+SEARCH_WORKERS = _env_int("CORTEX_SEARCH_WORKERS", 4)   # Query embedding + SQLite reads
+IO_WORKERS = _env_int("CORTEX_IO_WORKERS", 4)           # KB create, folder scans
+LAYOUT_WORKERS = _env_int("CORTEX_LAYOUT_WORKERS", 2)   # nx.spring_layout (CPU-bound, holds the GIL)
+
+search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="cortex-search")
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="cortex-io")
+# Graph reads stay off io_pool so slow folder scans can't queue ahead of /graph
+graph_pool = ThreadPoolExecutor(max_workers=LAYOUT_WORKERS, thread_name_prefix="cortex-graph")
+# Ingestion is a single long job; it gets its own thread so it never holds a request slot
+ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cortex-ingest")
+# 'spawn' keeps torch's threads out of the layout workers. A spawn child re-imports
+# the launching script, so server.py must not load the model at import time.
+layout_pool = ProcessPoolExecutor(max_workers=LAYOUT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+async def run_in(pool, fn, *args):
+    """Runs a blocking call on a dedicated executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, fn, *args)
+
+def shutdown_pools():
+    for pool in (search_pool, io_pool, graph_pool, ingest_pool, layout_pool):
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# ==========================================
+#        ADMISSION CONTROL
+# ==========================================
+
+class AdmissionLimiter:
+    """
+    Caps in-flight requests for one endpoint class. Up to `max_waiting` extra
+    callers queue for at most `wait_timeout` seconds; anything beyond that is
+    shed immediately with a 503 instead of piling onto the executors.
+    """
+    def __init__(self, name: str, max_concurrent: int, max_waiting: int, wait_timeout: float):
+        self.name = name
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+
+    def _reject(self, reason: str):
+        raise HTTPException(status_code=503, detail=f"{self.name} {reason}, retry shortly",
+                            headers={"Retry-After": "1"})
+
+    async def acquire(self):
+        if self._sem.locked():
+            if self._waiting >= self.max_waiting:
+                self._reject("is at capacity")
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout=self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue timed out")
+            finally:
+                self._waiting -= 1
+        else:
+            await self._sem.acquire()
+
+    def release(self):
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that owns an already-acquired limiter slot and releases
+    it exactly once when the response finishes, fails or is abandoned, even
+    if the body iterator was never started (e.g. the client reset the
+    connection before http.response.start).
+    """
+    def __init__(self, content, limiter: AdmissionLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+search_limiter = AdmissionLimiter("search", max_concurrent=SEARCH_WORKERS, max_waiting=32, wait_timeout=10.0)
+graph_limiter = AdmissionLimiter("graph", max_concurrent=LAYOUT_WORKERS, max_waiting=4, wait_timeout=30.0)
+ask_limiter = AdmissionLimiter("ask", max_concurrent=2, max_waiting=4, wait_timeout=30.0)
+io_limiter = AdmissionLimiter("io", max_concurrent=IO_WORKERS, max_waiting=16, wait_timeout=10.0)
+
+# ==========================================
+#        CPU-BOUND JOBS (process pool)
+# ==========================================
+
+def compute_layout(node_ids: List[int], edges: List[Tuple[int, int]]) -> Dict[int, Any]:
+    """Spring layout for the dependency graph. Runs in a layout worker process."""
+    import networkx as nx
+
+    G = nx.DiGraph()
+    G.add_nodes_from(node_ids)
+    G.add_edges_from(edges)
+
+    try:
+        pos = nx.spring_layout(G, k=0.5, iterations=50)
+    except Exception:
+        pos = {n: (0, 0) for n in node_ids}
+    return {n: (float(xy[0]), float(xy[1])) for n, xy in pos.items()}
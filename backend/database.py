@@ -107,6 +107,10 @@ def init_db(db_name: str):
     except sqlite3.OperationalError as e:
         print("❌ Failed to initialize Vector Table. Ensure sqlite-vec is installed and loaded. Error:", e)
 
+    # Re-ingest (ingest_cli.py) looks files up by path; keep that off a table scan
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file_path ON knowledge_chunks(file_path);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nodes_path ON nodes(json_extract(properties, '$.path'));")
+
     # --- SYSTEM CONFIG (For LLM Preferences) ---
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS system_config (
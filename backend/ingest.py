@@ -4,13 +4,15 @@ import struct
 import re
 import time
 import json
-from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
 from database import get_db_connection
+from retrieval import context_cache
 
 # --- Configuration ---
 CHUNK_SIZE = 500  # Characters per thought bubble (hunk)
 OVERLAP = 50      # Context overlap between bubbles
+EMBED_MODEL = 'all-MiniLM-L6-v2'
 
 # ==========================================
 #        GLOBAL STATE (For UI Monitoring)
@@ -72,9 +74,10 @@ def push_inspection_frame(file_name: str, chunk_index: int, content: str, embedd
         inspection_buffer.pop(0)
 
 def finish_status(msg: str):
+    update_status("", ingestion_status["processed_files"], ingestion_status["total_files"], msg)
+    # After update_status, which always marks the job as running
     ingestion_status["is_running"] = False
     ingestion_status["progress_percent"] = 100
-    update_status("", ingestion_status["processed_files"], ingestion_status["total_files"], msg)
 
 # ==========================================
 #        LOGIC CORE
@@ -119,21 +122,130 @@ class SynapseWeaver:
                     dependencies.append(clean_dep)
         return dependencies
 
+def prepare_file(model, chunker: Chunker, root_path: str, rel_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Reads, chunks and embeds a single file without touching the database.
+    Returns None for empty files. Safe to run inside a worker process.
+    """
+    full_path = os.path.join(root_path, rel_path)
+    with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read().strip()
+
+    if not content:
+        return None
+
+    chunks = chunker.chunk_text(content)
+    vectors = model.encode(chunks)
+
+    return {
+        "file_name": os.path.basename(full_path),
+        "rel_path": rel_path,
+        "chunks": chunks,
+        "vectors": [struct.pack(f'{len(vec)}f', *vec) for vec in vectors],
+        "previews": [vec[:5].tolist() for vec in vectors],
+    }
+
+@contextmanager
+def _file_savepoint(cursor):
+    """
+    Makes one file's writes atomic without committing them. A SAVEPOINT
+    outside a transaction would open (and on RELEASE, commit) its own, so an
+    outer transaction is started first if the caller has just committed.
+    """
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN")
+    cursor.execute("SAVEPOINT write_file")
+    try:
+        yield
+    except Exception:
+        cursor.execute("ROLLBACK TO write_file")
+        cursor.execute("RELEASE write_file")
+        raise
+    cursor.execute("RELEASE write_file")
+
+def delete_file_rows(cursor, rel_path: str):
+    """Removes everything previously ingested for a file (node, chunks, FTS rows, vectors)."""
+    # Both lookups are indexed (see init_db)
+    chunk_ids = [r[0] for r in cursor.execute(
+        "SELECT id FROM knowledge_chunks WHERE file_path = ?", (rel_path,)).fetchall()]
+    for chunk_id in chunk_ids:
+        cursor.execute("DELETE FROM knowledge_vectors WHERE rowid = ?", (chunk_id,))
+        cursor.execute("DELETE FROM documents_fts WHERE rowid = ?", (chunk_id,))
+    cursor.execute("DELETE FROM knowledge_chunks WHERE file_path = ?", (rel_path,))
+    # Edges go with the node (ON DELETE CASCADE)
+    cursor.execute("DELETE FROM nodes WHERE json_extract(properties, '$.path') = ? AND type = 'file'",
+                  (rel_path,))
+
+def remove_file(cursor, rel_path: str):
+    """Atomically drops a previously ingested file (e.g. one that is now empty)."""
+    with _file_savepoint(cursor):
+        delete_file_rows(cursor, rel_path)
+
+def write_prepared_file(cursor, prepared: Dict[str, Any], replace: bool = False) -> int:
+    """
+    Writes a prepared file (node, chunks, FTS rows, vectors). Returns the file node id.
+    The file is written atomically: if any insert fails, none of its rows remain.
+    With replace=True, rows from an earlier ingest of the same path are dropped first.
+    """
+    with _file_savepoint(cursor):
+        if replace:
+            delete_file_rows(cursor, prepared["rel_path"])
+
+        # --- 1. Create File Node (Prong II: Graph) ---
+        cursor.execute(
+            "INSERT INTO nodes (label, type, properties) VALUES (?, ?, ?) RETURNING id", 
+            (prepared["file_name"], 'file', json.dumps({"path": prepared["rel_path"]}))
+        )
+        file_node_id = cursor.fetchone()[0]
+
+        # --- 2. Chunks & Vectors (Prong I & III) ---
+        for chunk, vec_bytes in zip(prepared["chunks"], prepared["vectors"]):
+            # Store Chunk (Lexical)
+            cursor.execute("INSERT INTO knowledge_chunks (content, file_path, source_type) VALUES (?, ?, 'code') RETURNING id", 
+                          (chunk, prepared["rel_path"]))
+            chunk_id = cursor.fetchone()[0]
+
+            # Store FTS (Search)
+            cursor.execute("INSERT INTO documents_fts (rowid, content, file_path) VALUES (?, ?, ?)", 
+                          (chunk_id, chunk, prepared["rel_path"]))
+
+            # Store Vector (Semantic)
+            cursor.execute("INSERT INTO knowledge_vectors (rowid, embedding, chunk_id) VALUES (?, ?, ?)", 
+                          (chunk_id, vec_bytes, chunk_id))
+
+    return file_node_id
+
 class IngestionEngine:
     def __init__(self):
+        # The model is loaded on demand (see load_model) so that importing this
+        # module does not pull the weights into processes that never embed.
+        self._model = None
+        self._model_attempted = False
+
+    def load_model(self):
+        if self._model_attempted:
+            return self._model
+        self._model_attempted = True
         print("⚡ Loading Embedding Model...")
         try:
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Imported here: torch is heavy and most importers never embed
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(EMBED_MODEL)
             print("✔ Model Loaded.")
         except Exception as e:
             print(f"❌ Model Load Failed: {e}")
-            self.model = None
+            self._model = None
+        return self._model
+
+    @property
+    def model(self):
+        return self.load_model()
 
     def ingest_from_manifest(self, db_name: str, root_path: str, files: List[str], llm_model: str = "none"):
         print(f"⚡ Starting Ingestion for DB: {db_name}")
         
         if self.model is None:
-            update_status("Error", 0, 0, "❌ Logic Core Failed: Embedding Model not loaded.")
+            finish_status("❌ Logic Core Failed: Embedding Model not loaded.")
             return
 
         conn = get_db_connection(db_name)
@@ -154,54 +266,24 @@ class IngestionEngine:
         filename_to_id = {}
 
         for index, rel_path in enumerate(files):
-            full_path = os.path.join(root_path, rel_path)
-            file_name = os.path.basename(full_path)
+            file_name = os.path.basename(rel_path)
             
             update_status(file_name, index + 1, total_files, f"Reading {file_name}...")
 
             try:
-                with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read().strip()
+                prepared = prepare_file(self.model, chunker, root_path, rel_path)
                 
-                if not content:
+                if prepared is None:
                     update_status(file_name, index + 1, total_files, f"Skipped empty file: {file_name}")
                     continue
 
-                # --- 1. Create File Node (Prong II: Graph) ---
-                cursor.execute(
-                    "INSERT INTO nodes (label, type, properties) VALUES (?, ?, ?) RETURNING id", 
-                    (file_name, 'file', json.dumps({"path": rel_path}))
-                )
-                file_node_id = cursor.fetchone()[0]
+                file_node_id = write_prepared_file(cursor, prepared)
                 filename_to_id[file_name] = file_node_id
 
-                # --- 2. Chunking & Vectorization (Prong I & III) ---
-                chunks = chunker.chunk_text(content)
-                
-                for i, chunk in enumerate(chunks):
-                    # Embed
-                    vec = self.model.encode(chunk)
-                    vec_bytes = struct.pack(f'{len(vec)}f', *vec)
-                    
-                    # Store Chunk (Lexical)
-                    cursor.execute("INSERT INTO knowledge_chunks (content, file_path, source_type) VALUES (?, ?, 'code') RETURNING id", 
-                                  (chunk, rel_path))
-                    chunk_id = cursor.fetchone()[0]
-
-                    # Store FTS (Search)
-                    cursor.execute("INSERT INTO documents_fts (rowid, content, file_path) VALUES (?, ?, ?)", 
-                                  (chunk_id, chunk, rel_path))
-
-                    # Store Vector (Semantic)
-                    cursor.execute("INSERT INTO knowledge_vectors (rowid, embedding, chunk_id) VALUES (?, ?, ?)", 
-                                  (chunk_id, vec_bytes, chunk_id))
-                    
-                    # Link Chunk to File Node
-                    # (Optional: You could make chunks nodes too, but for now let's keep graph simple)
-
-                    # LIVE INSPECTION UPDATE
-                    # Send this hunk to the "Thought Bubble" pane
-                    push_inspection_frame(file_name, i, chunk, vec.tolist())
+                # LIVE INSPECTION UPDATE
+                # Send each hunk to the "Thought Bubble" pane
+                for i, chunk in enumerate(prepared["chunks"]):
+                    push_inspection_frame(file_name, i, chunk, prepared["previews"][i])
 
                 processed_count += 1
 
@@ -218,6 +300,7 @@ class IngestionEngine:
         
         conn.commit()
         conn.close()
+        context_cache.invalidate(db_name)
         finish_status(f"Ingestion Complete. {processed_count} files processed.")
         print("✅ Ingestion Complete")
 
@@ -0,0 +1,233 @@
+# ingest_cli.py
+"""
+Headless ingestion for cron / CI backfills (no server, no browser).
+
+    python backend/ingest_cli.py --db my_kb --root /path/to/repo
+    python backend/ingest_cli.py --manifest backfill.json --workers 8
+
+A manifest is a JSON object (or list of objects) shaped like the
+/ingest/execute payload: {"db_name", "root_path", "files"?, "llm_model"?}.
+When "files" is omitted the root is scanned with the UI's default exclusions.
+
+Reading, chunking and embedding fan out across a process pool (one model per
+worker); every database write goes through the single writer in the parent.
+Progress is emitted on stdout as JSON lines; human logs go to stderr.
+Exit code is 1 if any file (or job) failed, including a worker process dying.
+
+Jobs are safe to re-run: a file already in the KB (same relative path) is
+replaced, not duplicated. Relative paths are the identity, so two roots
+sharing one KB must not contain the same relative paths.
+"""
+import os
+import sys
+import json
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional
+
+sys.path.append(os.path.dirname(__file__))
+from database import get_db_connection, init_db
+from scanner import ProjectScanner
+
+COMMIT_EVERY = 50              # Files written between commits
+SUBMIT_WINDOW_PER_WORKER = 4   # Files queued or prepared-but-unwritten, per worker
+
+# ==========================================
+#        WORKER PROCESS
+# ==========================================
+
+_worker_model = None
+_worker_chunker = None
+
+def _init_worker(torch_threads: int):
+    global _worker_model, _worker_chunker
+    # Keep stdout clean for the JSON progress stream
+    sys.stdout = sys.stderr
+    # Each worker has its own model; split the cores between them instead of
+    # letting every torch instance spin up cpu_count threads
+    import torch
+    torch.set_num_threads(torch_threads)
+    from ingest import IngestionEngine, Chunker
+    _worker_model = IngestionEngine().load_model()
+    _worker_chunker = Chunker()
+
+def _prepare_task(task) -> Dict[str, Any]:
+    from ingest import prepare_file
+    root_path, rel_path = task
+    if _worker_model is None:
+        return {"rel_path": rel_path, "status": "error", "error": "Embedding model not loaded"}
+    try:
+        prepared = prepare_file(_worker_model, _worker_chunker, root_path, rel_path)
+    except Exception as e:
+        return {"rel_path": rel_path, "status": "error", "error": str(e)}
+    if prepared is None:
+        return {"rel_path": rel_path, "status": "skipped"}
+    return {"rel_path": rel_path, "status": "ok", "prepared": prepared}
+
+# ==========================================
+#        WRITER (PARENT PROCESS)
+# ==========================================
+
+def emit(event: str, **fields):
+    print(json.dumps({"event": event, **fields}), flush=True)
+
+def load_jobs(args) -> List[Dict[str, Any]]:
+    if args.manifest:
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        jobs = data if isinstance(data, list) else [data]
+    else:
+        jobs = [{"db_name": args.db, "root_path": args.root}]
+
+    for job in jobs:
+        job.setdefault("db_name", args.db)
+        job.setdefault("llm_model", args.llm_model)
+        if not job.get("db_name") or not job.get("root_path"):
+            raise ValueError(f"Manifest entry needs 'db_name' and 'root_path': {job}")
+    return jobs
+
+def make_pool(workers: int) -> ProcessPoolExecutor:
+    # 'spawn' gives each worker a clean interpreter and its own model instance.
+    # Unlike multiprocessing.Pool, a worker that dies (e.g. OOM-killed) breaks
+    # the executor with BrokenProcessPool instead of hanging forever.
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(torch_threads,),
+    )
+
+def run_job(pool: ProcessPoolExecutor, job: Dict[str, Any], workers: int) -> int:
+    """
+    Ingests one (db_name, root_path) job. Returns the number of failed files.
+    Raises BrokenProcessPool if a worker process dies.
+    """
+    db_name = job["db_name"]
+    root_path = job["root_path"]
+
+    if not os.path.isdir(root_path):
+        emit("job_error", db=db_name, root=root_path, error="Path does not exist")
+        return 1
+
+    files: Optional[List[str]] = job.get("files")
+    if files is None:
+        files = ProjectScanner(root_path).collect_files()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db(db_name)
+
+    total = len(files)
+    emit("job_start", db=db_name, root=root_path, total=total)
+
+    # get_db_connection may print warnings; keep them off the JSON stream
+    with contextlib.redirect_stdout(sys.stderr):
+        conn = get_db_connection(db_name)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR REPLACE INTO system_config (key, value) VALUES (?, ?)",
+                  ('preferred_agent_model', job["llm_model"]))
+
+    from ingest import write_prepared_file, remove_file
+
+    counts = {"ok": 0, "skipped": 0, "error": 0}
+    # Bounded submit window: each finished future holds a whole prepared file
+    # (chunks + vectors), so only a few are in flight and each is dropped as
+    # soon as it has been written.
+    window = workers * SUBMIT_WINDOW_PER_WORKER
+    pending_files = iter(files)
+    in_flight = set()
+    done = 0
+
+    def refill():
+        while len(in_flight) < window:
+            rel_path = next(pending_files, None)
+            if rel_path is None:
+                return
+            in_flight.add(pool.submit(_prepare_task, (root_path, rel_path)))
+
+    try:
+        refill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight.discard(future)
+                result = future.result()
+                done += 1
+                status = result["status"]
+                event = {"db": db_name, "path": result["rel_path"], "status": status,
+                         "processed": done, "total": total}
+
+                try:
+                    if status == "ok":
+                        write_prepared_file(cursor, result["prepared"], replace=True)
+                        event["chunks"] = len(result["prepared"]["chunks"])
+                    elif status == "skipped":
+                        # An empty file must not keep its old chunks around
+                        remove_file(cursor, result["rel_path"])
+                except Exception as e:
+                    status = event["status"] = "error"
+                    result["error"] = str(e)
+                if status == "error":
+                    event["error"] = result["error"]
+
+                counts[status] += 1
+                emit("file", **event)
+
+                if done % COMMIT_EVERY == 0:
+                    conn.commit()
+            refill()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        conn.commit()
+        conn.close()
+
+    emit("job_done", db=db_name, root=root_path, total=total, **counts)
+    return counts["error"]
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless multi-process Cortex ingestion.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--root", help="Folder to scan and ingest")
+    source.add_argument("--manifest", help="JSON manifest of ingest jobs")
+    parser.add_argument("--db", help="Target Knowledge Base (required with --root)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Embedding worker processes (default: CPU count)")
+    parser.add_argument("--llm-model", default="none", help="Stored as preferred_agent_model")
+    args = parser.parse_args(argv)
+
+    if args.root and not args.db:
+        parser.error("--db is required with --root")
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+
+    try:
+        jobs = load_jobs(args)
+    except (OSError, ValueError) as e:
+        emit("error", error=str(e))
+        return 1
+
+    failures = 0
+    pool = make_pool(args.workers)
+    try:
+        for job in jobs:
+            try:
+                failures += run_job(pool, job, args.workers)
+            except BrokenProcessPool as e:
+                emit("job_error", db=job["db_name"], root=job["root_path"],
+                     error=f"Worker process died: {e}")
+                failures += 1
+                # A broken executor can't take more work; start fresh for the next job
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = make_pool(args.workers)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    emit("done", jobs=len(jobs), failures=failures)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
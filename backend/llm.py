@@ -0,0 +1,58 @@
+# llm.py
+import os
+import json
+import httpx
+from typing import AsyncIterator, Dict, Any, List, Optional
+
+# --- Configuration ---
+# Any Ollama-compatible server works (including a local stub for tests)
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_LIST_TIMEOUT = float(os.environ.get("OLLAMA_LIST_TIMEOUT", "5"))       # Whole /api/tags call
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_TIMEOUT", "120"))          # Seconds between bytes, not total
+
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    """Shared async client (connection pooling to the Ollama host)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=OLLAMA_URL,
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def list_models() -> List[str]:
+    """Names of the models installed on the Ollama host (/api/tags)."""
+    response = await get_client().get(
+        "/api/tags",
+        timeout=httpx.Timeout(OLLAMA_LIST_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+    )
+    response.raise_for_status()
+    return [m['name'] for m in response.json().get('models', [])]
+
+async def stream_generate(model: str, prompt: str, system: str = "") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams /api/generate. Yields each NDJSON frame as Ollama sends it:
+    {"response": "<token>", "done": false} ... {"done": true, "eval_count": ...}
+    """
+    payload = {"model": model, "prompt": prompt, "system": system, "stream": True}
+    async with get_client().stream("POST", "/api/generate", json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            line = line.strip()
+            if not line:
+                continue
+            frame = json.loads(line)
+            if frame.get("error"):
+                raise RuntimeError(frame["error"])
+            yield frame
+            if frame.get("done"):
+                break
@@ -0,0 +1,134 @@
+# retrieval.py
+import struct
+import threading
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
+from database import get_db_path
+
+# --- Configuration ---
+CHARS_PER_TOKEN = 4         # Rough token estimate; good enough for budget packing
+CONTEXT_CACHE_SIZE = 256    # Assembled contexts kept in memory (LRU)
+
+# RRF Query (Vector + FTS)
+HYBRID_SQL = """
+WITH
+vec_results AS (
+    SELECT rowid, distance,
+    row_number() OVER (ORDER BY distance) as rank
+    FROM knowledge_vectors
+    WHERE embedding MATCH ?
+    AND k = 50
+),
+fts_results AS (
+    SELECT rowid, rank as fts_rank,
+    row_number() OVER (ORDER BY rank) as rank
+    FROM documents_fts
+    WHERE documents_fts MATCH ?
+    LIMIT 50
+)
+SELECT
+    kc.id,
+    kc.file_path,
+    kc.content,
+    (
+        COALESCE(1.0 / (60 + v.rank), 0.0) +
+        COALESCE(1.0 / (60 + f.rank), 0.0)
+    ) as rrf_score
+FROM knowledge_chunks kc
+LEFT JOIN vec_results v ON kc.id = v.rowid
+LEFT JOIN fts_results f ON kc.id = f.rowid
+WHERE v.rowid IS NOT NULL OR f.rowid IS NOT NULL
+ORDER BY rrf_score DESC
+LIMIT ?;
+"""
+
+def hybrid_search(conn, model, q: str, limit: int) -> List[Tuple[int, str, str, float]]:
+    """Runs the RRF hybrid query. Returns (chunk_id, file_path, content, score) rows."""
+    query_vector = model.encode(q)
+    query_bytes = struct.pack(f'{len(query_vector)}f', *query_vector)
+
+    # Escape quotes for FTS
+    fts_query = '"' + q.replace('"', '""') + '"'
+
+    return conn.execute(HYBRID_SQL, (query_bytes, fts_query, limit)).fetchall()
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+def assemble_context(rows: List[Tuple[int, str, str, float]], token_budget: int) -> Dict[str, Any]:
+    """
+    Deduplicates ranked chunks and greedily packs them (best score first)
+    until the token budget is spent. Chunks that don't fit are skipped so a
+    smaller, lower-ranked chunk can still use the remaining room.
+    """
+    seen_ids = set()
+    seen_content = set()
+    packed = []
+    used = 0
+
+    for chunk_id, file_path, content, score in rows:
+        text = content.strip()
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if chunk_id in seen_ids or digest in seen_content or not text:
+            continue
+        seen_ids.add(chunk_id)
+        seen_content.add(digest)
+
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            continue
+
+        packed.append({"id": chunk_id, "path": file_path, "content": text, "score": round(score, 4)})
+        used += cost
+
+    prompt_context = "\n\n".join(f"### {c['path']}\n{c['content']}" for c in packed)
+    return {"chunks": packed, "tokens": used, "text": prompt_context}
+
+def kb_stamp(conn) -> Tuple[int]:
+    """
+    Cheap fingerprint of a KB's contents. Catches writes made by other
+    processes (e.g. ingest_cli.py) that never reach invalidate().
+    knowledge_chunks.id is AUTOINCREMENT and re-ingested files get fresh ids,
+    so MAX(id) moves on every write and is a single index lookup.
+    """
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM knowledge_chunks").fetchone()
+
+def _kb_key(db_name: str) -> str:
+    # 'proj' and 'proj.db' are the same KB
+    return get_db_path(db_name)
+
+class ContextCache:
+    """LRU of assembled contexts keyed by (KB, query, budget)."""
+    def __init__(self, max_size: int = CONTEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, Tuple[tuple, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db_name: str, query: str, token_budget: int, stamp: tuple):
+        key = (_kb_key(db_name), query, token_budget)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != tuple(stamp):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, db_name: str, query: str, token_budget: int, stamp: tuple, context: Dict[str, Any]):
+        key = (_kb_key(db_name), query, token_budget)
+        with self._lock:
+            self._entries[key] = (tuple(stamp), context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, db_name: str):
+        kb = _kb_key(db_name)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == kb]:
+                del self._entries[key]
+
+context_cache = ContextCache()
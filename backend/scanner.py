@@ -66,6 +66,26 @@ class ProjectScanner:
         
         return self._scan_recursive(self.root_path)
 
+    def collect_files(self) -> List[str]:
+        """
+        Returns the ingestible files (paths relative to root) using the same
+        defaults the UI applies: excluded folders, binaries and lockfiles are skipped.
+        """
+        files: List[str] = []
+        if not self.root_path.is_dir():
+            return files
+
+        for dirpath, dirnames, filenames in os.walk(self.root_path):
+            # Prune excluded folders in-place so os.walk never descends into them
+            dirnames[:] = sorted(d for d in dirnames if d not in EXCLUDED_FOLDERS)
+            for name in sorted(filenames, key=str.lower):
+                file_path = Path(dirpath) / name
+                if self.is_excluded_name(name) or self.is_binary(file_path):
+                    continue
+                files.append(file_path.relative_to(self.root_path).as_posix())
+
+        return files
+
     def _scan_recursive(self, current_path: Path) -> Dict:
         node = {
             "name": current_path.name,
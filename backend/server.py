@@ -1,21 +1,44 @@
 import sys
 import os
-import struct
-import networkx as nx
-import urllib.request # Added for Ollama connectivity
+import time
+import sqlite3
+import traceback
 import json
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
 # Import our local modules
 sys.path.append(os.path.dirname(__file__))
-from database import get_db_connection, init_db, KB_DIR
-from ingest import engine, ingestion_status, inspection_buffer
+from database import get_db_connection, get_db_path, init_db, KB_DIR
+from ingest import engine, ingestion_status, inspection_buffer, finish_status
 from scanner import ProjectScanner
+from retrieval import hybrid_search as run_hybrid_search, assemble_context, kb_stamp, context_cache
+from concurrency import (
+    run_in, compute_layout, shutdown_pools,
+    search_pool, io_pool, graph_pool, ingest_pool, layout_pool,
+    search_limiter, graph_limiter, ask_limiter, io_limiter,
+    SlotStreamingResponse,
+)
+import llm
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server embeds on every search, so load the model up front. This
+    # lives here rather than at import time: 'spawn' layout workers re-import
+    # this file as __mp_main__ and must not load the model themselves.
+    engine.load_model()
+    yield
+    await llm.close_client()
+    shutdown_pools()
 
-app = FastAPI(title="Cortex API - Multi-Project")
+# Every endpoint is 'async def': cheap ones (status, lists, inspection) answer
+# straight from the event loop, heavy ones hand off to a dedicated, size-limited
+# pool (see concurrency.py) behind an admission limiter. Nothing runs on
+# FastAPI's shared threadpool, so a slow /graph can't starve /ingest/status.
+app = FastAPI(title="Cortex API - Multi-Project", lifespan=lifespan)
 
 # Enable CORS for React
 app.add_middleware(
@@ -41,12 +64,18 @@ class IngestRequest(BaseModel):
     files: List[str]     # The specific manifest of files to ingest
     llm_model: Optional[str] = "none"
 
+class AskRequest(BaseModel):
+    db_name: str
+    q: str
+    model: Optional[str] = None   # Falls back to the KB's preferred_agent_model
+    token_budget: int = Field(2000, gt=0)  # Max (estimated) tokens of retrieved context
+
 # ==========================================
 #        KNOWLEDGE BASE MANAGER
 # ==========================================
 
 @app.get("/kb/list")
-def list_knowledge_bases():
+async def list_knowledge_bases():
     """Lists all available SQLite databases in the data directory."""
     if not os.path.exists(KB_DIR):
         return {"databases": []}
@@ -55,11 +84,14 @@ def list_knowledge_bases():
     return {"databases": dbs}
 
 @app.post("/kb/create")
-def create_knowledge_base(req: KBRequest):
+async def create_knowledge_base(req: KBRequest):
     """Initializes a new empty Knowledge Base."""
     try:
-        init_db(req.name)
+        async with io_limiter.slot():
+            await run_in(io_pool, init_db, req.name)
         return {"status": "success", "message": f"Created {req.name}.db"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -68,21 +100,14 @@ def create_knowledge_base(req: KBRequest):
 # ==========================================
 
 @app.get("/llm/models")
-def get_ollama_models():
+async def get_ollama_models():
     """
     Connects to local Ollama instance (default port 11434) 
     and retrieves the list of available models.
     """
-    ollama_url = "http://localhost:11434/api/tags"
     try:
-        with urllib.request.urlopen(ollama_url) as response:
-            if response.status == 200:
-                data = json.loads(response.read().decode())
-                # Extract model names from Ollama response
-                models = [m['name'] for m in data.get('models', [])]
-                return {"status": "online", "models": models}
-            else:
-                return {"status": "error", "models": [], "detail": "Ollama returned non-200 status"}
+        models = await llm.list_models()
+        return {"status": "online", "models": models}
     except Exception as e:
         # If connection fails, assume Ollama is not running
         return {"status": "offline", "models": [], "detail": str(e)}
@@ -92,40 +117,61 @@ def get_ollama_models():
 # ==========================================
 
 @app.post("/stage/scan")
-def scan_source(req: ScanRequest):
+async def scan_source(req: ScanRequest):
     """
     Scans a target path and returns a file tree.
     Does NOT ingest yet. Just maps the territory.
     """
     if req.type == "folder":
         scanner = ProjectScanner(req.path)
-        tree = scanner.scan()
+        async with io_limiter.slot():
+            tree = await run_in(io_pool, scanner.scan)
         if "error" in tree:
             raise HTTPException(status_code=400, detail=tree["error"])
         return {"tree": tree}
     
     return {"status": "error", "message": "Type not supported yet"}
 
+def _report_ingest_failure(future):
+    # Nobody awaits the ingest future, so surface its errors here
+    if future.cancelled() or future.exception() is None:
+        return
+    e = future.exception()
+    traceback.print_exception(type(e), e, e.__traceback__)
+    finish_status(f"❌ Ingestion failed: {e}")
+
 @app.post("/ingest/execute")
-def execute_ingest(req: IngestRequest, background_tasks: BackgroundTasks):
+async def execute_ingest(req: IngestRequest):
     """
     Starts the heavy lifting in the background.
     """
     if ingestion_status["is_running"]:
         raise HTTPException(status_code=409, detail="Ingestion already in progress")
+    # Claim the job here, on the event loop, so check-and-set is atomic. Waiting
+    # for the ingest thread to set it would let a second POST slip through.
+    ingestion_status["is_running"] = True
     
-    # Pass the job to the background
-    background_tasks.add_task(
-        engine.ingest_from_manifest, 
-        req.db_name, 
-        req.root_path, 
-        req.files, 
-        req.llm_model
-    )
+    # Contexts assembled from the old contents are now stale
+    context_cache.invalidate(req.db_name)
+
+    # Pass the job to the background (its own thread, not a request slot)
+    try:
+        future = ingest_pool.submit(
+            engine.ingest_from_manifest, 
+            req.db_name, 
+            req.root_path, 
+            req.files, 
+            req.llm_model
+        )
+    except RuntimeError:
+        # Executor already shut down (server stopping)
+        ingestion_status["is_running"] = False
+        raise HTTPException(status_code=503, detail="Server is shutting down")
+    future.add_done_callback(_report_ingest_failure)
     return {"status": "started", "message": "Ingestion started in background"}
 
 @app.get("/ingest/status")
-def get_ingest_status():
+async def get_ingest_status():
     """
     Polled by UI to show progress bar.
     """
@@ -135,61 +181,16 @@ def get_ingest_status():
 #        QUERY & SEARCH (Dynamic DB)
 # ==========================================
 
-@app.get("/search")
-def hybrid_search(q: str, db_name: str, limit: int = 10):
-    """
-    Performs Hybrid Search on a SPECIFIC database.
-    """
+def _search_sync(db_name: str, q: str, limit: int) -> List[Dict[str, Any]]:
+    # Runs on search_pool: the connection must stay on the thread that opened it
     try:
         conn = get_db_connection(db_name)
     except Exception as e:
         raise HTTPException(status_code=404, detail="Database not found")
-        
-    cursor = conn.cursor()
-
-    # 1. Generate Query Vector
-    query_vector = engine.model.encode(q)
-    query_bytes = struct.pack(f'{len(query_vector)}f', *query_vector)
-
-    # 2. Execute RRF Query (Vector + FTS)
-    sql = """
-    WITH 
-    vec_results AS (
-        SELECT rowid, distance,
-        row_number() OVER (ORDER BY distance) as rank
-        FROM knowledge_vectors
-        WHERE embedding MATCH ?
-        AND k = 50
-    ),
-    fts_results AS (
-        SELECT rowid, rank as fts_rank,
-        row_number() OVER (ORDER BY rank) as rank
-        FROM documents_fts
-        WHERE documents_fts MATCH ?
-        LIMIT 50
-    )
-    SELECT 
-        kc.id,
-        kc.file_path,
-        kc.content,
-        (
-            COALESCE(1.0 / (60 + v.rank), 0.0) +
-            COALESCE(1.0 / (60 + f.rank), 0.0)
-        ) as rrf_score
-    FROM knowledge_chunks kc
-    LEFT JOIN vec_results v ON kc.id = v.rowid
-    LEFT JOIN fts_results f ON kc.id = f.rowid
-    WHERE v.rowid IS NOT NULL OR f.rowid IS NOT NULL
-    ORDER BY rrf_score DESC
-    LIMIT ?;
-    """
-    
-    # Escape quotes for FTS
-    fts_query = f'"{q.replace('"', '""')}"'
-    
+
     results = []
     try:
-        rows = cursor.execute(sql, (query_bytes, fts_query, limit)).fetchall()
+        rows = run_hybrid_search(conn, engine.model, q, limit)
         for r in rows:
             results.append({
                 "id": r[0],
@@ -200,47 +201,57 @@ def hybrid_search(q: str, db_name: str, limit: int = 10):
     except Exception as e:
         print(f"Search Error: {e}")
         pass
+    finally:
+        conn.close()
 
-    return {"results": results}
+    return results
 
-@app.get("/graph")
-def get_graph_data(db_name: str):
+@app.get("/search")
+async def hybrid_search(q: str, db_name: str, limit: int = 10):
     """
-    Visualizes the dependency graph for a SPECIFIC database.
+    Performs Hybrid Search on a SPECIFIC database.
     """
+    async with search_limiter.slot():
+        results = await run_in(search_pool, _search_sync, db_name, q, limit)
+
+    return {"results": results}
+
+def _fetch_graph_sync(db_name: str):
     try:
         conn = get_db_connection(db_name)
     except Exception:
         raise HTTPException(status_code=404, detail="Database not found")
-        
-    cursor = conn.cursor()
-    
-    db_nodes = cursor.execute("SELECT id, label, type FROM nodes").fetchall()
-    
-    # Optimization: Don't fetch all content, just paths
-    chunk_rows = cursor.execute("SELECT file_path FROM knowledge_chunks").fetchall()
-    
-    db_edges = cursor.execute("SELECT source_id, target_id FROM edges").fetchall()
-    
-    G = nx.DiGraph()
-    for n in db_nodes:
-        G.add_node(n[0], label=n[1], type=n[2])
-        
-    for e in db_edges:
-        G.add_edge(e[0], e[1])
-        
+
     try:
-        pos = nx.spring_layout(G, k=0.5, iterations=50)
-    except:
-        pos = {n[0]: (0,0) for n in db_nodes}
-    
+        cursor = conn.cursor()
+        db_nodes = cursor.execute("SELECT id, label, type FROM nodes").fetchall()
+        db_edges = cursor.execute("SELECT source_id, target_id FROM edges").fetchall()
+    finally:
+        conn.close()
+    return db_nodes, db_edges
+
+@app.get("/graph")
+async def get_graph_data(db_name: str):
+    """
+    Visualizes the dependency graph for a SPECIFIC database.
+    """
+    async with graph_limiter.slot():
+        db_nodes, db_edges = await run_in(graph_pool, _fetch_graph_sync, db_name)
+
+        # spring_layout is pure-Python CPU work: keep it in a worker process
+        pos = await run_in(
+            layout_pool, compute_layout,
+            [n[0] for n in db_nodes], [(e[0], e[1]) for e in db_edges]
+        )
+
+    attrs = {n[0]: (n[1], n[2]) for n in db_nodes}
     formatted_nodes = []
     for node_id, coords in pos.items():
-        attrs = G.nodes[node_id]
+        label, node_type = attrs[node_id]
         formatted_nodes.append({
             "id": str(node_id),
-            "label": attrs['label'],
-            "type": attrs['type'],
+            "label": label,
+            "type": node_type,
             "x": coords[0] * 1000, # Scale up for UI
             "y": coords[1] * 1000
         })
@@ -249,8 +260,109 @@ def get_graph_data(db_name: str):
 
     return {"nodes": formatted_nodes, "links": formatted_links}
 
+# ==========================================
+#        RETRIEVAL-AUGMENTED ANSWERS
+# ==========================================
+
+ASK_RETRIEVAL_K = 50
+ASK_SYSTEM_PROMPT = (
+    "You are Cortex, an assistant answering questions about a codebase. "
+    "Use only the provided context. If the context is insufficient, say so."
+)
+
+def _ask_context_sync(req: AskRequest):
+    """Resolves the model and the (possibly cached) context. Runs on search_pool."""
+    conn = get_db_connection(req.db_name)
+    try:
+        model = req.model
+        if not model:
+            row = conn.execute("SELECT value FROM system_config WHERE key = 'preferred_agent_model'").fetchone()
+            model = row[0] if row else None
+        if not model or model == "none":
+            raise HTTPException(status_code=400, detail="No LLM model selected for this Knowledge Base")
+
+        stamp = kb_stamp(conn)
+        context = context_cache.get(req.db_name, req.q, req.token_budget, stamp)
+        cached = context is not None
+        if not cached:
+            if engine.model is None:
+                raise HTTPException(status_code=503, detail="Embedding model not loaded")
+            rows = run_hybrid_search(conn, engine.model, req.q, ASK_RETRIEVAL_K)
+            context = assemble_context(rows, req.token_budget)
+            context_cache.put(req.db_name, req.q, req.token_budget, stamp, context)
+    except sqlite3.Error as e:
+        # e.g. a KB created without sqlite-vec has no knowledge_vectors table
+        print(f"Search Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Retrieval failed: {e}")
+    finally:
+        conn.close()
+    return model, context, cached
+
+async def _answer_stream(model: str, prompt: str, context: Dict[str, Any], cached: bool,
+                         started: float, retrieval_ms: float):
+    """
+    NDJSON events for one answer: context, tokens as they arrive, then done/error.
+    `started` is when the request arrived, so ttft_ms includes retrieval and
+    context assembly (the work the context cache saves).
+    """
+    yield json.dumps({
+        "type": "context",
+        "model": model,
+        "cached": cached,
+        "retrieval_ms": retrieval_ms,
+        "context_tokens": context["tokens"],
+        "chunks": [{"id": c["id"], "path": c["path"], "score": c["score"]} for c in context["chunks"]],
+    }) + "\n"
+
+    ttft_ms = None
+    try:
+        async for frame in llm.stream_generate(model, prompt, ASK_SYSTEM_PROMPT):
+            token = frame.get("response", "")
+            if token:
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield json.dumps({"type": "token", "text": token}) + "\n"
+            if frame.get("done"):
+                break
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+        return
+
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"/ask [{model}] retrieval={retrieval_ms}ms ttft={ttft_ms}ms total={total_ms}ms cached_context={cached}")
+    yield json.dumps({"type": "done", "retrieval_ms": retrieval_ms, "ttft_ms": ttft_ms, "total_ms": total_ms}) + "\n"
+
+@app.post("/ask")
+async def ask(req: AskRequest):
+    """
+    Answers a question with the local LLM, grounded on hybrid-search context.
+    Streams NDJSON events: one 'context', many 'token', then 'done' (or 'error').
+    """
+    started = time.perf_counter()
+    if not os.path.exists(get_db_path(req.db_name)):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    # The slot is held for the whole response; SlotStreamingResponse gives it
+    # back however the response ends (including a client that never reads it)
+    await ask_limiter.acquire()
+    try:
+        async with search_limiter.slot():
+            model, context, cached = await run_in(search_pool, _ask_context_sync, req)
+    except BaseException:
+        ask_limiter.release()
+        raise
+    retrieval_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    prompt = f"Context:\n{context['text']}\n\nQuestion: {req.q}\nAnswer:"
+
+    return SlotStreamingResponse(
+        _answer_stream(model, prompt, context, cached, started, retrieval_ms),
+        limiter=ask_limiter,
+        media_type="application/x-ndjson",
+    )
+
 @app.get("/ingest/inspection")
-def get_inspection_frame():
+async def get_inspection_frame():
     """
     Returns the latest processing artifacts for the visualization pane.
     The frontend should poll this every ~200ms.
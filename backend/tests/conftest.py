@@ -0,0 +1,48 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import database
+
+class FakeModel:
+    """Stands in for SentenceTransformer: deterministic 384-d vectors, no torch."""
+    dim = 384
+
+    def _vec(self, text: str):
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        vec = np.random.default_rng(seed).uniform(-1, 1, self.dim).astype(np.float32)
+        return vec / np.linalg.norm(vec)
+
+    def encode(self, texts):
+        if isinstance(texts, str):
+            return self._vec(texts)
+        return np.stack([self._vec(t) for t in texts])
+
+@pytest.fixture
+def fake_model():
+    return FakeModel()
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    """Points every Knowledge Base at a throwaway directory."""
+    path = tmp_path / "kbs"
+    path.mkdir()
+    monkeypatch.setattr(database, "KB_DIR", str(path))
+    return path
+
+@pytest.fixture
+def app_client(kb_dir, fake_model, monkeypatch):
+    """TestClient over server.app with the fake embedding model loaded."""
+    from fastapi.testclient import TestClient
+    import server
+
+    monkeypatch.setattr(server.engine, "_model", fake_model)
+    monkeypatch.setattr(server.engine, "_model_attempted", True)
+    # The executors are module-level; keep them alive across tests
+    monkeypatch.setattr(server, "shutdown_pools", lambda: None)
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,100 @@
+import json
+
+import httpx
+import pytest
+
+import llm
+import server
+from database import init_db, get_db_connection
+from ingest import Chunker, prepare_file, write_prepared_file
+
+TOKENS = ["The ", "answer ", "is 42."]
+
+def ollama_stub(request: httpx.Request) -> httpx.Response:
+    """Minimal Ollama-compatible /api/generate: streams NDJSON frames."""
+    assert request.url.path == "/api/generate"
+    body = json.loads(request.content)
+    if body["model"] == "broken":
+        return httpx.Response(500, json={"error": "model crashed"})
+    frames = [{"response": t, "done": False} for t in TOKENS] + [{"response": "", "done": True}]
+    return httpx.Response(200, content="".join(json.dumps(f) + "\n" for f in frames).encode())
+
+@pytest.fixture
+def client(app_client, monkeypatch):
+    monkeypatch.setattr(llm, "_client", httpx.AsyncClient(
+        base_url="http://ollama.test", transport=httpx.MockTransport(ollama_stub)))
+    return app_client
+
+def make_kb(tmp_path, fake_model, name="kb", model="stub-llm"):
+    init_db(name)
+    root = tmp_path / "src"
+    root.mkdir(exist_ok=True)
+    (root / "answer.py").write_text("def answer():\n    # The answer to everything\n    return 42\n")
+    conn = get_db_connection(name)
+    cursor = conn.cursor()
+    write_prepared_file(cursor, prepare_file(fake_model, Chunker(), str(root), "answer.py"))
+    if model:
+        cursor.execute("INSERT OR REPLACE INTO system_config (key, value) VALUES ('preferred_agent_model', ?)", (model,))
+    conn.commit()
+    conn.close()
+    return root
+
+def ask(client, **body):
+    with client.stream("POST", "/ask", json={"db_name": "kb", "q": "answer", **body}) as r:
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in r.iter_lines() if line]
+
+def test_ask_streams_context_tokens_then_done(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model)
+    events = ask(client)
+
+    assert [e["type"] for e in events] == ["context"] + ["token"] * len(TOKENS) + ["done"]
+    context, done = events[0], events[-1]
+    assert context["model"] == "stub-llm" and context["cached"] is False
+    assert [c["path"] for c in context["chunks"]] == ["answer.py"]
+    assert "".join(e["text"] for e in events[1:-1]) == "".join(TOKENS)
+    # The clock starts at request entry, so TTFT includes retrieval
+    assert done["ttft_ms"] is not None and done["ttft_ms"] >= done["retrieval_ms"]
+
+def test_ask_reuses_cached_context_until_kb_changes(client, tmp_path, fake_model):
+    root = make_kb(tmp_path, fake_model)
+    assert ask(client)[0]["cached"] is False
+    assert ask(client)[0]["cached"] is True
+    assert ask(client, token_budget=50)[0]["cached"] is False   # different budget, different entry
+
+    # A write from outside the server (e.g. ingest_cli.py) moves the KB stamp
+    (root / "more.py").write_text("answer = 42\n")
+    conn = get_db_connection("kb")
+    write_prepared_file(conn.cursor(), prepare_file(fake_model, Chunker(), str(root), "more.py"))
+    conn.commit()
+    conn.close()
+    assert ask(client)[0]["cached"] is False
+
+def test_ask_explicit_model_overrides_preference(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model, model=None)
+    assert ask(client, model="other")[0]["model"] == "other"
+
+def test_ask_without_model_is_400(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model, model=None)
+    r = client.post("/ask", json={"db_name": "kb", "q": "answer"})
+    assert r.status_code == 400
+
+def test_ask_rejects_bad_requests(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model)
+    assert client.post("/ask", json={"db_name": "kb", "q": "x", "token_budget": 0}).status_code == 422
+    assert client.post("/ask", json={"db_name": "missing", "q": "x"}).status_code == 404
+
+def test_ask_reports_upstream_failure_as_error_event(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model)
+    events = ask(client, model="broken")
+    assert [e["type"] for e in events] == ["context", "error"]
+    assert "500" in events[-1]["detail"]
+
+def test_ask_releases_admission_slot(client, tmp_path, fake_model):
+    make_kb(tmp_path, fake_model)
+    before = server.ask_limiter._sem._value
+    for _ in range(before + 2):
+        ask(client, model="broken")
+        ask(client)
+    assert server.ask_limiter._sem._value == before
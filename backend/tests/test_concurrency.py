@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from concurrency import AdmissionLimiter, SlotStreamingResponse
+
+async def hold(limiter, until: asyncio.Event):
+    async with limiter.slot():
+        await until.wait()
+
+def test_limiter_sheds_when_capacity_and_queue_are_full():
+    async def scenario():
+        limiter = AdmissionLimiter("t", max_concurrent=1, max_waiting=1, wait_timeout=5)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, release))
+        queued = asyncio.create_task(hold(limiter, release))
+        await asyncio.sleep(0)
+        assert limiter._waiting == 1
+
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire()
+        release.set()
+        await asyncio.gather(holder, queued)
+        return exc.value
+
+    err = asyncio.run(scenario())
+    assert err.status_code == 503
+    assert err.headers == {"Retry-After": "1"}
+    assert "at capacity" in err.detail
+
+def test_limiter_queue_timeout_is_503_and_leaves_no_waiters():
+    async def scenario():
+        limiter = AdmissionLimiter("t", max_concurrent=1, max_waiting=4, wait_timeout=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire()
+        waiting_after = limiter._waiting
+        release.set()
+        await holder
+        return exc.value, waiting_after, limiter
+
+    err, waiting_after, limiter = asyncio.run(scenario())
+    assert err.status_code == 503 and "timed out" in err.detail
+    assert waiting_after == 0
+    assert limiter._sem._value == 1
+
+def test_slot_streaming_response_releases_once_when_send_fails():
+    async def body():
+        yield "never sent"
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def reset_send(message):
+        # A client that resets the connection fails on http.response.start
+        raise ConnectionResetError("client went away")
+
+    async def scenario():
+        limiter = AdmissionLimiter("ask", max_concurrent=2, max_waiting=0, wait_timeout=0.05)
+        for _ in range(3):
+            await limiter.acquire()
+            response = SlotStreamingResponse(body(), limiter=limiter)
+            # Starlette's task group may wrap the send error in an ExceptionGroup
+            with pytest.raises((ConnectionResetError, BaseExceptionGroup)):
+                await response({"type": "http"}, receive, reset_send)
+            response.release()   # Already released: must be a no-op
+            assert limiter._sem._value == 2
+        return limiter
+
+    asyncio.run(scenario())
+
+def test_slot_streaming_response_releases_after_normal_stream():
+    sent = []
+
+    async def body():
+        yield "a"
+        yield "b"
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message["type"])
+
+    async def scenario():
+        limiter = AdmissionLimiter("ask", max_concurrent=1, max_waiting=0, wait_timeout=0.05)
+        await limiter.acquire()
+        await SlotStreamingResponse(body(), limiter=limiter)({"type": "http"}, receive, send)
+        return limiter._sem._value
+
+    assert asyncio.run(scenario()) == 1
+    assert sent[0] == "http.response.start" and sent.count("http.response.body") >= 2
@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+from database import init_db, get_db_connection
+from ingest import write_prepared_file, remove_file
+
+def prepared(rel_path, chunks, vectors=None):
+    vec = struct.pack("384f", *([0.1] * 384))
+    return {
+        "file_name": rel_path.split("/")[-1],
+        "rel_path": rel_path,
+        "chunks": chunks,
+        "vectors": vectors if vectors is not None else [vec] * len(chunks),
+    }
+
+@pytest.fixture
+def conn(kb_dir):
+    init_db("writer")
+    conn = get_db_connection("writer")
+    yield conn
+    conn.close()
+
+def counts(conn, rel_path):
+    return (
+        conn.execute("SELECT COUNT(*) FROM nodes WHERE json_extract(properties, '$.path') = ?", (rel_path,)).fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM knowledge_chunks WHERE file_path = ?", (rel_path,)).fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM documents_fts WHERE file_path = ?", (rel_path,)).fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM knowledge_vectors").fetchone()[0],
+    )
+
+def test_failed_file_leaves_no_rows(conn):
+    bad = prepared("bad.py", ["a", "b"], vectors=[struct.pack("384f", *([0.1] * 384)), b"not-a-vector"])
+    with pytest.raises(Exception):
+        write_prepared_file(conn.cursor(), bad)
+    conn.commit()
+    assert counts(conn, "bad.py") == (0, 0, 0, 0)
+
+def test_writes_after_commit_stay_in_one_transaction(conn):
+    cursor = conn.cursor()
+    write_prepared_file(cursor, prepared("one.py", ["a"]))
+    conn.commit()
+    # A bare SAVEPOINT would have committed this file on RELEASE
+    write_prepared_file(cursor, prepared("two.py", ["b"]))
+    assert conn.in_transaction
+    conn.rollback()
+    assert counts(conn, "two.py")[:3] == (0, 0, 0)
+
+def test_replace_and_remove(conn):
+    cursor = conn.cursor()
+    write_prepared_file(cursor, prepared("m.py", ["a", "b"]))
+    write_prepared_file(cursor, prepared("m.py", ["c"]), replace=True)
+    assert counts(conn, "m.py") == (1, 1, 1, 1)
+    remove_file(cursor, "m.py")
+    conn.commit()
+    assert counts(conn, "m.py") == (0, 0, 0, 0)
+
+def test_replace_lookups_use_indexes(conn):
+    plans = [
+        " ".join(str(r[-1]) for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", ("m.py",)))
+        for sql in (
+            "SELECT id FROM knowledge_chunks WHERE file_path = ?",
+            "DELETE FROM nodes WHERE json_extract(properties, '$.path') = ? AND type = 'file'",
+        )
+    ]
+    assert "idx_chunks_file_path" in plans[0]
+    assert "idx_nodes_path" in plans[1]
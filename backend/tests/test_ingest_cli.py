@@ -0,0 +1,109 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ingest
+import ingest_cli
+from database import get_db_connection
+
+@pytest.fixture
+def cli(kb_dir, fake_model, monkeypatch, capsys):
+    """Runs main() with an in-process pool and a fake model; returns (exit_code, events)."""
+    def init_fake_worker():
+        monkeypatch.setattr(ingest_cli, "_worker_model", fake_model)
+        monkeypatch.setattr(ingest_cli, "_worker_chunker", ingest.Chunker())
+
+    # Tiny window and batches so refills and mid-job commits are exercised
+    monkeypatch.setattr(ingest_cli, "SUBMIT_WINDOW_PER_WORKER", 1)
+    monkeypatch.setattr(ingest_cli, "COMMIT_EVERY", 2)
+    monkeypatch.setattr(ingest_cli, "make_pool",
+                        lambda workers: ThreadPoolExecutor(max_workers=workers, initializer=init_fake_worker))
+
+    def run(*argv):
+        capsys.readouterr()
+        code = ingest_cli.main(["--workers", "1", *argv])
+        out = capsys.readouterr().out
+        # Every stdout line must be a JSON event
+        return code, [json.loads(line) for line in out.splitlines()]
+    return run
+
+@pytest.fixture
+def repo(tmp_path):
+    root = tmp_path / "repo"
+    (root / "pkg").mkdir(parents=True)
+    (root / "main.py").write_text("import pkg.util\nprint('main')\n")
+    (root / "pkg" / "util.py").write_text("def helper():\n    return 42\n" * 40)
+    (root / "empty.txt").write_text("")
+    return root
+
+def rows(db_name):
+    conn = get_db_connection(db_name)
+    try:
+        return (
+            sorted(conn.execute("SELECT label, COUNT(*) FROM nodes GROUP BY label").fetchall()),
+            conn.execute("SELECT COUNT(*) FROM knowledge_chunks").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM knowledge_vectors").fetchone()[0],
+        )
+    finally:
+        conn.close()
+
+def test_root_ingest_emits_json_events(cli, repo):
+    code, events = cli("--root", str(repo), "--db", "kb")
+    assert code == 0
+    kinds = [e["event"] for e in events]
+    assert kinds[0] == "job_start" and kinds[-2:] == ["job_done", "done"]
+    files = {e["path"]: e for e in events if e["event"] == "file"}
+    assert set(files) == {"main.py", "pkg/util.py", "empty.txt"}
+    assert files["pkg/util.py"]["status"] == "ok" and files["pkg/util.py"]["chunks"] > 1
+    assert files["empty.txt"]["status"] == "skipped"
+    assert events[-2] == {"event": "job_done", "db": "kb", "root": str(repo), "total": 3,
+                          "ok": 2, "skipped": 1, "error": 0}
+    assert events[-1] == {"event": "done", "jobs": 1, "failures": 0}
+
+    labels, chunks, vectors = rows("kb")
+    assert labels == [("main.py", 1), ("util.py", 1)]
+    assert chunks == vectors > 2
+
+def test_rerun_replaces_instead_of_duplicating(cli, repo):
+    cli("--root", str(repo), "--db", "kb")
+    before = rows("kb")
+    assert cli("--root", str(repo), "--db", "kb")[0] == 0
+    assert rows("kb") == before
+
+    # A file that became empty drops its old chunks
+    (repo / "pkg" / "util.py").write_text("")
+    cli("--root", str(repo), "--db", "kb")
+    labels, chunks, _ = rows("kb")
+    assert labels == [("main.py", 1)]
+    assert chunks == 1
+
+def test_failed_file_exits_non_zero(cli, repo, tmp_path):
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps({"db_name": "kb", "root_path": str(repo),
+                                    "files": ["main.py", "missing.py"]}))
+    code, events = cli("--manifest", str(manifest))
+    assert code == 1
+    failed = [e for e in events if e["event"] == "file" and e["status"] == "error"]
+    assert [e["path"] for e in failed] == ["missing.py"] and failed[0]["error"]
+    assert events[-1] == {"event": "done", "jobs": 1, "failures": 1}
+    # The good file is still written
+    assert rows("kb")[0] == [("main.py", 1)]
+
+def test_missing_root_is_a_job_error(cli, repo, tmp_path):
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps([
+        {"db_name": "kb", "root_path": str(tmp_path / "gone")},
+        {"db_name": "kb", "root_path": str(repo)},
+    ]))
+    code, events = cli("--manifest", str(manifest))
+    assert code == 1
+    assert events[0]["event"] == "job_error"
+    assert events[-1] == {"event": "done", "jobs": 2, "failures": 1}
+
+def test_bad_manifest_exits_non_zero(cli, tmp_path):
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps({"root_path": str(tmp_path)}))
+    code, events = cli("--manifest", str(manifest))
+    assert code == 1
+    assert events[0]["event"] == "error"
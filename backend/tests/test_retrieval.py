@@ -0,0 +1,73 @@
+from retrieval import assemble_context, ContextCache, CHARS_PER_TOKEN
+
+def row(chunk_id, path, tokens, fill="x", score=0.5):
+    return (chunk_id, path, fill * (tokens * CHARS_PER_TOKEN), score)
+
+# ==========================================
+#        assemble_context
+# ==========================================
+
+def test_assemble_context_dedupes_by_id_and_content():
+    rows = [
+        row(1, "a.py", 5, "a"),
+        row(1, "a.py", 5, "a"),         # same chunk id
+        row(2, "b.py", 5, "a"),         # same content, different chunk (overlap / re-ingest)
+        row(3, "c.py", 5, "c"),
+    ]
+    ctx = assemble_context(rows, token_budget=100)
+    assert [c["id"] for c in ctx["chunks"]] == [1, 3]
+    assert ctx["tokens"] == 10
+
+def test_assemble_context_packs_best_first_within_budget():
+    rows = [row(1, "a.py", 6, "a", 0.9), row(2, "b.py", 4, "b", 0.8), row(3, "c.py", 4, "c", 0.7)]
+    ctx = assemble_context(rows, token_budget=10)
+    assert [c["id"] for c in ctx["chunks"]] == [1, 2]
+    assert ctx["tokens"] == 10
+    assert ctx["text"].startswith("### a.py\n")
+
+def test_assemble_context_skips_chunk_that_does_not_fit():
+    rows = [row(1, "a.py", 6, "a"), row(2, "big.py", 50, "b"), row(3, "c.py", 3, "c")]
+    ctx = assemble_context(rows, token_budget=10)
+    # The oversized chunk is skipped, the smaller one after it still gets in
+    assert [c["id"] for c in ctx["chunks"]] == [1, 3]
+    assert ctx["tokens"] <= 10
+
+def test_assemble_context_empty():
+    ctx = assemble_context([], token_budget=10)
+    assert ctx == {"chunks": [], "tokens": 0, "text": ""}
+
+# ==========================================
+#        ContextCache
+# ==========================================
+
+def test_cache_hit_normalizes_kb_name():
+    cache = ContextCache()
+    cache.put("kb", "q", 100, (7,), {"text": "ctx"})
+    assert cache.get("kb.db", "q", 100, (7,)) == {"text": "ctx"}
+    assert cache.get("kb", "other", 100, (7,)) is None
+    assert cache.get("kb", "q", 200, (7,)) is None
+
+def test_cache_stale_stamp_is_dropped():
+    cache = ContextCache()
+    cache.put("kb", "q", 100, (7,), {"text": "ctx"})
+    assert cache.get("kb", "q", 100, (8,)) is None
+    # The stale entry is gone even if asked with the old stamp
+    assert cache.get("kb", "q", 100, (7,)) is None
+
+def test_cache_invalidate_only_touches_that_kb():
+    cache = ContextCache()
+    cache.put("kb", "q", 100, (1,), {"text": "a"})
+    cache.put("other", "q", 100, (1,), {"text": "b"})
+    cache.invalidate("kb.db")
+    assert cache.get("kb", "q", 100, (1,)) is None
+    assert cache.get("other", "q", 100, (1,)) == {"text": "b"}
+
+def test_cache_evicts_least_recently_used():
+    cache = ContextCache(max_size=2)
+    cache.put("kb", "q1", 100, (1,), {"text": "1"})
+    cache.put("kb", "q2", 100, (1,), {"text": "2"})
+    assert cache.get("kb", "q1", 100, (1,)) is not None   # q1 is now most recent
+    cache.put("kb", "q3", 100, (1,), {"text": "3"})
+    assert cache.get("kb", "q2", 100, (1,)) is None
+    assert cache.get("kb", "q1", 100, (1,)) is not None
+    assert cache.get("kb", "q3", 100, (1,)) is not None
@@ -0,0 +1,26 @@
+from scanner import ProjectScanner
+
+def write(path, data=b"print('hi')\n"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+def test_collect_files_applies_default_exclusions(tmp_path):
+    write(tmp_path / "main.py")
+    write(tmp_path / "src" / "pkg" / "util.ts")
+    write(tmp_path / "node_modules" / "dep" / "index.js")    # excluded folder
+    write(tmp_path / "src" / "__pycache__" / "util.py")      # excluded folder, nested
+    write(tmp_path / "package-lock.json")                    # excluded filename
+    write(tmp_path / "yarn.lock")                            # excluded glob
+    write(tmp_path / "logo.png")                             # binary by extension
+    write(tmp_path / "blob.txt", b"abc\0def")                # binary by content sniff
+
+    assert ProjectScanner(str(tmp_path)).collect_files() == ["main.py", "src/pkg/util.ts"]
+
+def test_collect_files_returns_posix_paths_relative_to_root(tmp_path):
+    write(tmp_path / "a" / "b" / "c.md", b"# doc\n")
+    files = ProjectScanner(str(tmp_path)).collect_files()
+    assert files == ["a/b/c.md"]
+    assert (tmp_path / files[0]).exists()
+
+def test_collect_files_missing_root(tmp_path):
+    assert ProjectScanner(str(tmp_path / "nope")).collect_files() == []
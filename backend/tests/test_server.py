@@ -0,0 +1,63 @@
+import threading
+import time
+
+import server
+from concurrency import io_pool, IO_WORKERS
+from database import init_db
+
+def test_second_ingest_is_rejected_while_first_is_queued(app_client, monkeypatch):
+    monkeypatch.setitem(server.ingestion_status, "is_running", False)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_ingest(db_name, root_path, files, llm_model):
+        started.set()
+        release.wait(5)
+        server.finish_status("done")
+
+    monkeypatch.setattr(server.engine, "ingest_from_manifest", slow_ingest)
+    body = {"db_name": "kb", "root_path": "/tmp", "files": []}
+
+    assert app_client.post("/ingest/execute", json=body).status_code == 200
+    # Rejected at once, not queued behind the first job on the ingest thread
+    assert app_client.post("/ingest/execute", json=body).status_code == 409
+
+    release.set()
+    assert started.wait(5)
+    deadline = time.time() + 5
+    while app_client.get("/ingest/status").json()["is_running"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert app_client.post("/ingest/execute", json=body).status_code == 200
+    release.set()
+
+def test_ingest_failure_is_reported_in_status(app_client, monkeypatch):
+    monkeypatch.setitem(server.ingestion_status, "is_running", False)
+
+    def broken_ingest(*args):
+        raise RuntimeError("disk on fire")
+
+    monkeypatch.setattr(server.engine, "ingest_from_manifest", broken_ingest)
+    assert app_client.post("/ingest/execute", json={"db_name": "kb", "root_path": "/tmp", "files": []}).status_code == 200
+
+    deadline = time.time() + 5
+    while app_client.get("/ingest/status").json()["is_running"] and time.time() < deadline:
+        time.sleep(0.01)
+    status = app_client.get("/ingest/status").json()
+    assert status["is_running"] is False
+    assert "disk on fire" in status["log"][-1]
+
+def test_graph_is_not_starved_by_busy_io_pool(app_client):
+    init_db("kb")
+    release = threading.Event()
+    # Saturate io_pool the way slow /stage/scan calls would
+    blockers = [io_pool.submit(release.wait, 10) for _ in range(IO_WORKERS)]
+    try:
+        started = time.perf_counter()
+        r = app_client.get("/graph", params={"db_name": "kb"})
+        assert r.status_code == 200
+        assert r.json() == {"nodes": [], "links": []}
+        assert time.perf_counter() - started < 5
+    finally:
+        release.set()
+        for b in blockers:
+            b.result()